@@ -2,9 +2,152 @@ import json
 from typing import Dict, Optional, Any, Union, Tuple, List, Set
 import numpy as np
 import networkx as nx
+from numpy.typing import DTypeLike
+from scipy import sparse
+from scipy.sparse.csgraph import breadth_first_order
 from apis.serialisable import Serialisable
 
 
+def _reverse_bfs_order(T: sparse.csr_matrix, terminal_mask: np.ndarray) -> np.ndarray:
+    """
+    Permutation of state indices: terminal states first, then the rest by BFS
+    distance to a terminal over reversed transitions, unreachable states last.
+    """
+    nS = len(terminal_mask)
+    A = T.shape[0] // nS if nS else 0
+    coo = T.tocoo()
+    live = coo.data > 0
+    terminals = np.flatnonzero(terminal_mask)
+
+    # reversed edges s' -> s, plus a virtual root (node nS) pointing at every terminal
+    rows = np.concatenate([coo.col[live], np.full(len(terminals), nS)])
+    cols = np.concatenate([coo.row[live] // max(A, 1), terminals])
+    G = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(nS + 1, nS + 1))
+    bfs = breadth_first_order(G, nS, directed=True, return_predecessors=False)[1:]
+
+    seen = terminal_mask.copy()
+    seen[bfs] = True
+    return np.concatenate([terminals, bfs[~terminal_mask[bfs]], np.flatnonzero(~seen)]).astype(np.int64)
+
+
+def _transition_triples(mdp_network: "MDPNetwork",
+                        idx: Dict[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every stored (s, a, s') triple with s in idx and 0 <= a < num_actions, read in one pass
+    over the graph edges. Returns arrays (i, a, j, p, r): i = idx[s], j = idx[s'] or -1 for
+    successors outside idx, p = P(s'|s,a), r = R(s,a,s'). Triples of one (s, a) keep
+    successor order, as in get_transition_probabilities.
+    """
+    i_list: List[int] = []
+    a_list: List[int] = []
+    j_list: List[int] = []
+    p_list: List[float] = []
+    r_list: List[float] = []
+    A = mdp_network.num_actions
+    G = mdp_network.graph
+    for s, i in idx.items():
+        for sp, edata in G.adj[s].items():
+            j = idx.get(sp, -1)
+            for a, tr in edata.get("transitions", {}).items():
+                if 0 <= a < A:
+                    i_list.append(i)
+                    a_list.append(a)
+                    j_list.append(j)
+                    p_list.append(tr["p"])
+                    r_list.append(tr["r"])
+    return (np.array(i_list, dtype=np.int64), np.array(a_list, dtype=np.int64), np.array(j_list, dtype=np.int64),
+            np.array(p_list, dtype=np.float64), np.array(r_list, dtype=np.float64))
+
+
+def _build_dense_model(mdp_network: "MDPNetwork") -> Tuple[List[int], Dict[int, int], sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    Array form of the MDP. States are indexed by position in the returned `states`
+    (terminals first, then reverse-BFS order); idx maps state id -> index.
+    Returns (states, idx, T, R, terminal_mask):
+      T is a CSR matrix of shape (|S| * A, |S|) with T[s * A + a, s'] = P(s'|s,a),
+      so T @ V reshaped to (|S|, A) is the expected next value of every (s,a);
+      R[s, a] = sum_s' P(s'|s,a) * R(s,a,s').
+    (s,a) pairs without transitions self-loop with default_reward.
+    """
+    states = list(mdp_network.states)
+    idx = {s: i for i, s in enumerate(states)}
+    nS, A = len(states), mdp_network.num_actions
+    terminal_mask = np.array([mdp_network.is_terminal_state(s) for s in states], dtype=bool)
+
+    i, a, j, p, r = _transition_triples(mdp_network, idx)
+    pair = i * A + a
+    # astype: bincount returns int64 for an empty pair array, even with weights
+    R = np.bincount(pair, weights=p * r, minlength=nS * A).astype(np.float64)
+
+    # (s,a) pairs without transitions self-loop with default_reward;
+    # successors outside `states` are never updated, i.e. V(s') = 0
+    empty = np.bincount(pair, minlength=nS * A) == 0
+    R[empty] = mdp_network.default_reward
+    loops = np.flatnonzero(empty)
+    inside = j >= 0
+    rows = np.concatenate([pair[inside], loops])
+    cols = np.concatenate([j[inside], loops // max(A, 1)])
+    data = np.concatenate([p[inside], np.ones(len(loops))])
+    T = sparse.csr_matrix((data, (rows, cols)), shape=(nS * A, nS))
+    R = R.reshape(nS, A)
+
+    # Relabel states in reverse-BFS order from the terminals. Neighbouring states then get
+    # nearby indices, so T is banded and each SpMV / in-place sweep touches V in a small,
+    # cache-resident window; in-place sweeps also propagate values backwards in index order.
+    perm = _reverse_bfs_order(T, terminal_mask)
+    rows = (perm[:, None] * A + np.arange(A)).ravel()
+    T = T[rows][:, perm].tocsr()
+    T.sort_indices()
+    states = [states[i] for i in perm]
+    idx = {s: i for i, s in enumerate(states)}
+    return states, idx, T, R[perm], terminal_mask[perm]
+
+
+def _build_sampling_tables(mdp_network: "MDPNetwork",
+                           states: List[int],
+                           idx: Dict[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Padded successor tables for drawing s' ~ P(.|s,a) without dict lookups.
+    Returns (next_idx, cdf, rewards), each of shape (|S|, A, k_max):
+      successor indices (-1 padding), cumulative probabilities (inf padding) and R(s,a,s').
+    (s,a) pairs without transitions self-loop with default_reward, as in sample_step.
+    Successors outside `states` map to index |S|, one extra absorbing state with V = 0:
+    they keep their probability and reward, as in _build_dense_model. Arrays indexed by
+    successor (Q, terminal_mask) need a row |S| for it, marked terminal.
+    """
+    nS, A = len(states), mdp_network.num_actions
+    i, a, j, p, r = _transition_triples(mdp_network, idx)
+    keep = p > 0
+    pair, j, p, r = i[keep] * A + a[keep], j[keep], p[keep], r[keep]
+    j[j < 0] = nS
+
+    # slot of each triple within its (s,a) row, in successor order
+    order = np.argsort(pair, kind="stable")
+    pair, j, p, r = pair[order], j[order], p[order], r[order]
+    counts = np.bincount(pair, minlength=nS * A)
+    k_max = max(int(counts.max(initial=0)), 1)
+    slot = np.arange(len(pair)) - (np.cumsum(counts) - counts)[pair]
+
+    next_idx = np.full((nS * A, k_max), -1, dtype=np.int64)
+    probs = np.zeros((nS * A, k_max), dtype=np.float64)
+    rewards = np.zeros((nS * A, k_max), dtype=np.float64)
+    next_idx[pair, slot] = j
+    probs[pair, slot] = p
+    rewards[pair, slot] = r
+
+    cdf = np.cumsum(probs, axis=1)
+    filled = np.flatnonzero(counts)
+    cdf[filled] /= cdf[filled, -1:]
+    cdf[np.arange(k_max) >= counts[:, None]] = np.inf
+    cdf[filled, counts[filled] - 1] = 1.0  # guard against round-off so u < 1 always lands on a successor
+
+    loops = np.flatnonzero(counts == 0)
+    next_idx[loops, 0] = loops // max(A, 1)
+    cdf[loops, 0] = 1.0
+    rewards[loops, 0] = mdp_network.default_reward
+    return next_idx.reshape(nS, A, k_max), cdf.reshape(nS, A, k_max), rewards.reshape(nS, A, k_max)
+
+
 class MDPNetwork(Serialisable):
     """
     MDP over a directed graph with R(s, a, s').
@@ -44,6 +187,12 @@ class MDPNetwork(Serialisable):
             norm_list = [self._normalize_state_input(s) for s in lst]
             self.tags[name] = set(int(x) for x in norm_list)
 
+        # array forms of the model, built on demand and dropped on mutation
+        self._dense_cache: Dict[np.dtype, Tuple[List[int], Dict[int, int], sparse.csr_matrix, np.ndarray, np.ndarray]] = {}
+        self._sparse_cache: Dict[np.dtype, List[sparse.csr_matrix]] = {}
+        self._sampling_cache: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._cached_attrs: Optional[Tuple[Any, ...]] = None
+
         self._build_graph()
 
     # -------------------------
@@ -69,6 +218,7 @@ class MDPNetwork(Serialisable):
         Accepts legacy transitions without rewards (use default_reward).
         """
         self.graph = nx.DiGraph()
+        self.invalidate_cache()
 
         for s in self.states:
             self.graph.add_node(int(s), is_terminal=(int(s) in self.terminal_states))
@@ -228,6 +378,7 @@ class MDPNetwork(Serialisable):
             self.terminal_states.add(s)
         if is_start and s not in self.start_states:
             self.start_states.append(s)
+        self.invalidate_cache()
 
     def add_transition(self,
                        from_state: Union[int, str],
@@ -244,6 +395,7 @@ class MDPNetwork(Serialisable):
             "p": float(probability),
             "r": float(self.default_reward if reward is None else reward),
         }
+        self.invalidate_cache()
 
     def renormalize_action(self, state: Union[int, str], action: int):
         s = self._normalize_state_input(state)
@@ -256,6 +408,7 @@ class MDPNetwork(Serialisable):
         if total > 0.0:
             for _, item in pairs:
                 item["p"] = float(item["p"] / total)
+        self.invalidate_cache()
 
     def update_transition_reward(self,
                                  state: Union[int, str],
@@ -270,6 +423,7 @@ class MDPNetwork(Serialisable):
         if "transitions" not in edata or action not in edata["transitions"]:
             raise KeyError(f"No (s,a,s') triple for (s={s}, a={action}, s'={sp})")
         edata["transitions"][action]["r"] = float(reward)
+        self.invalidate_cache()
 
     def compute_expected_reward(self,
                                 state: Union[int, str],
@@ -287,6 +441,71 @@ class MDPNetwork(Serialisable):
     def get_graph_copy(self) -> nx.DiGraph:
         return self.graph.copy()
 
+    # -------------------------
+    # Array form
+    # -------------------------
+    def as_dense(self, dtype: DTypeLike = np.float64) -> Tuple[List[int], Dict[int, int], sparse.csr_matrix, np.ndarray, np.ndarray]:
+        """
+        Cached (states, idx, T, R, terminal_mask) used by the solvers; see _build_dense_model.
+        Built once per dtype and reused until the MDP is mutated. The arrays are shared
+        between callers and must not be modified.
+        """
+        self._check_cache()
+        key = np.dtype(dtype)
+        if key not in self._dense_cache:
+            if key == np.float64:
+                states, idx, T, R, terminal_mask = _build_dense_model(self)
+            else:
+                states, idx, T, R, terminal_mask = self.as_dense()
+                T, R = T.astype(key), R.astype(key)
+            R.flags.writeable = False
+            terminal_mask.flags.writeable = False
+            self._dense_cache[key] = (states, idx, T, R, terminal_mask)
+        return self._dense_cache[key]
+
+    def as_sparse(self, dtype: DTypeLike = np.float64) -> List[sparse.csr_matrix]:
+        """Cached per-action (|S|, |S|) CSR matrices T_a[s, s'] = P(s'|s,a), indexed like as_dense()."""
+        self._check_cache()
+        key = np.dtype(dtype)
+        if key not in self._sparse_cache:
+            T = self.as_dense(key)[2]
+            A = self.num_actions
+            self._sparse_cache[key] = [T[a::A].tocsr() for a in range(A)]
+        return self._sparse_cache[key]
+
+    def as_sampling_tables(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Cached (next_idx, cdf, rewards) successor tables indexed like as_dense(), used by
+        q_learning; see _build_sampling_tables.
+        Shared between callers and read-only.
+        """
+        self._check_cache()
+        if self._sampling_cache is None:
+            states, idx = self.as_dense()[:2]
+            tables = _build_sampling_tables(self, states, idx)
+            for arr in tables:
+                arr.flags.writeable = False
+            self._sampling_cache = tables
+        return self._sampling_cache
+
+    def invalidate_cache(self):
+        """
+        Drop the cached array forms. Called by the mutation methods; call it after editing
+        `graph` directly. Edits of states, terminal_states, default_reward or num_actions are
+        detected on the next as_* call (start_states is read live by the solvers).
+        """
+        self._dense_cache.clear()
+        self._sparse_cache.clear()
+        self._sampling_cache = None
+        self._cached_attrs = None
+
+    def _check_cache(self):
+        """Invalidate if a public attribute baked into the cached arrays changed since they were built."""
+        attrs = (tuple(self.states), frozenset(self.terminal_states), self.default_reward, self.num_actions)
+        if attrs != self._cached_attrs:
+            self.invalidate_cache()
+            self._cached_attrs = attrs
+
     # -------------------------
     # Export
     # -------------------------
@@ -52,6 +52,17 @@ class QTable(Serialisable):
 
     # clone() comes from Serialisable via round-trip
 
+    # -------- Array interface --------
+    @classmethod
+    def from_array(cls, q_array: np.ndarray, index_to_state: List[int]) -> "QTable":
+        """
+        Bulk-build from an (num_states, num_actions) array.
+        Row i holds the Q-values of state index_to_state[i].
+        """
+        rows = np.asarray(q_array, dtype=np.float64).tolist()
+        q_values = {int(s): dict(enumerate(row)) for s, row in zip(index_to_state, rows)}
+        return cls(q_values=q_values)
+
     # -------- QTable API --------
     def get_q_value(self, state: int, action: int) -> float:
         """Get Q-value for a state-action pair."""
@@ -197,6 +208,16 @@ class ValueTable(Serialisable):
 
     # clone() comes from Serialisable
 
+    # -------- Array interface --------
+    @classmethod
+    def from_array(cls, value_array: np.ndarray, index_to_state: List[int]) -> "ValueTable":
+        """
+        Bulk-build from a (num_states,) array.
+        Entry i holds the value of state index_to_state[i].
+        """
+        vals = np.asarray(value_array, dtype=np.float64).tolist()
+        return cls(values={int(s): v for s, v in zip(index_to_state, vals)})
+
     # -------- ValueTable API --------
     def get_value(self, state: int) -> float:
         """Get value for a state."""
@@ -1,8 +1,263 @@
-from typing import Dict, List, Tuple, Optional, Any
+from typing import List, Tuple, Optional, Any
 import numpy as np
+from numpy.typing import DTypeLike
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+try:
+    from numba import njit, prange
+    _NUMBA_AVAILABLE = True
+except ImportError:  # optional: fall back to the NumPy sweeps
+    _NUMBA_AVAILABLE = False
+
+try:
+    from joblib import Parallel, delayed, effective_n_jobs
+    _JOBLIB_AVAILABLE = True
+except ImportError:  # optional: only needed for q_learning(n_jobs != 1)
+    _JOBLIB_AVAILABLE = False
+
+try:
+    import cupy as cp
+    import cupyx.scipy.sparse as cp_sparse
+    _CUPY_AVAILABLE = True
+except ImportError:  # optional: only needed for device="cuda"
+    _CUPY_AVAILABLE = False
 
 from .mdp_tables import QTable, ValueTable, PolicyTable, RewardDistributionTable
-from .mdp_network import MDPNetwork
+from .mdp_network import MDPNetwork, _transition_triples
+
+
+def _build_policy_matrix(policy: PolicyTable, states: List[int], num_actions: int,
+                         dtype: DTypeLike = np.float64) -> sparse.csr_matrix:
+    """
+    Pi[s, a] = pi(a|s) as an (|S|, A) CSR matrix, indexed like MDPNetwork.as_dense.
+    Only actions with pi(a|s) > 0 are stored, so (indptr, indices, data) is the policy
+    support per state: one entry per state for a deterministic policy.
+    """
+    rows, cols, probs = [], [], []
+    for i, s in enumerate(states):
+        for a, pi_sa in policy.get_action_probabilities(s).items():
+            if pi_sa > 0 and 0 <= a < num_actions:
+                rows.append(i)
+                cols.append(a)
+                probs.append(pi_sa)
+    Pi = sparse.csr_matrix((np.array(probs, dtype=dtype), (rows, cols)), shape=(len(states), num_actions))
+    Pi.sum_duplicates()
+    return Pi
+
+
+def _policy_weights(Pi: sparse.csr_matrix, terminal_mask: np.ndarray) -> sparse.csr_matrix:
+    """
+    W[s, s*A+a] = pi(a|s) as an (|S|, |S|·A) CSR matrix over the policy support, so that
+    W @ T mixes the rows of T the policy can reach. Rows of terminal states are zero.
+    """
+    nS, A = Pi.shape
+    s_of = np.repeat(np.arange(nS), np.diff(Pi.indptr))
+    keep = ~terminal_mask[s_of]
+    return sparse.csr_matrix((Pi.data[keep], (s_of[keep], s_of[keep] * A + Pi.indices[keep])),
+                             shape=(nS, nS * A))
+
+
+_SWEEP_METHODS = ("jacobi", "gauss_seidel", "sor")
+
+
+def _resolve_method(method: Optional[str]) -> str:
+    """
+    method=None picks "gauss_seidel" when numba compiles the in-place sweep and "jacobi"
+    otherwise: without numba, Gauss-Seidel is a Python loop over states while Jacobi is one SpMV.
+    """
+    if method is None:
+        method = "gauss_seidel" if _NUMBA_AVAILABLE else "jacobi"
+    if method not in _SWEEP_METHODS:
+        raise ValueError(f"Unknown method: {method} (expected one of {_SWEEP_METHODS})")
+    return method
+
+
+if _NUMBA_AVAILABLE:
+    # Compiled sweeps over the CSR arrays of gamma * T (or of gamma * P_pi for a fixed
+    # policy). They read V_in and write V_out; passing the same array gives in-place
+    # (Gauss-Seidel / SOR) updates. Jacobi sweeps (separate buffers) have independent
+    # states and run across cores with prange. Terminal states are not in `order` and
+    # keep V = 0. Accumulators start from 0.0, so they stay float64 for float32 inputs.
+
+    @njit(cache=True, fastmath=True)
+    def _policy_backup_numba(indptr, indices, data, r, V, s):
+        acc = 0.0
+        for j in range(indptr[s], indptr[s + 1]):
+            acc += data[j] * V[indices[j]]
+        return r[s] + acc
+
+    @njit(cache=True, fastmath=True)
+    def _optimal_backup_numba(indptr, indices, data, R, V, s):
+        A = R.shape[1]
+        best = 0.0  # seeded from a = 0: fastmath assumes no infinities, so -inf is unsafe
+        for a in range(A):
+            row = s * A + a
+            acc = 0.0
+            for j in range(indptr[row], indptr[row + 1]):
+                acc += data[j] * V[indices[j]]
+            q = R[s, a] + acc
+            if a == 0 or q > best:
+                best = q
+        return best
+
+    @njit(cache=True, fastmath=True)
+    def _policy_sweep_numba(indptr, indices, data, r, V_out, V_in, order, omega):
+        max_delta = 0.0
+        for k in range(order.shape[0]):
+            s = order[k]
+            v_old = V_in[s]
+            v_s = (1.0 - omega) * v_old + omega * _policy_backup_numba(indptr, indices, data, r, V_in, s)
+            delta = abs(v_s - v_old)
+            if delta > max_delta:
+                max_delta = delta
+            V_out[s] = v_s
+        return max_delta
+
+    @njit(cache=True, fastmath=True)
+    def _optimal_sweep_numba(indptr, indices, data, R, V_out, V_in, order, omega):
+        max_delta = 0.0
+        for k in range(order.shape[0]):
+            s = order[k]
+            v_old = V_in[s]
+            v_s = (1.0 - omega) * v_old + omega * _optimal_backup_numba(indptr, indices, data, R, V_in, s)
+            delta = abs(v_s - v_old)
+            if delta > max_delta:
+                max_delta = delta
+            V_out[s] = v_s
+        return max_delta
+
+    @njit(cache=True, fastmath=True, parallel=True)
+    def _policy_jacobi_numba(indptr, indices, data, r, V_out, V_in, order):
+        for k in prange(order.shape[0]):
+            s = order[k]
+            V_out[s] = _policy_backup_numba(indptr, indices, data, r, V_in, s)
+        max_delta = 0.0
+        for k in range(order.shape[0]):
+            delta = abs(V_out[order[k]] - V_in[order[k]])
+            if delta > max_delta:
+                max_delta = delta
+        return max_delta
+
+    @njit(cache=True, fastmath=True, parallel=True)
+    def _optimal_jacobi_numba(indptr, indices, data, R, V_out, V_in, order):
+        for k in prange(order.shape[0]):
+            s = order[k]
+            V_out[s] = _optimal_backup_numba(indptr, indices, data, R, V_in, s)
+        max_delta = 0.0
+        for k in range(order.shape[0]):
+            delta = abs(V_out[order[k]] - V_in[order[k]])
+            if delta > max_delta:
+                max_delta = delta
+        return max_delta
+
+
+def _state_action_values(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, R: np.ndarray,
+                         V: np.ndarray, s: int, actions: range, out: np.ndarray) -> np.ndarray:
+    """
+    Q(s, .) = R[s] + gT[s*A:(s+1)*A] @ V read straight from the CSR arrays of gT = gamma * T.
+    Written into the preallocated out (A,) buffer, which is returned.
+    """
+    base = s * len(actions)
+    for a in actions:
+        lo, hi = indptr[base + a], indptr[base + a + 1]
+        out[a] = R[s, a] + data[lo:hi] @ V[indices[lo:hi]]
+    return out
+
+
+def _max_abs_change(V_old: np.ndarray, V_new: np.ndarray) -> float:
+    """max |V_new - V_old|, computed in place: V_old is used as scratch and is clobbered."""
+    np.subtract(V_old, V_new, out=V_old)
+    np.abs(V_old, out=V_old)
+    return float(V_old.max()) if len(V_old) else 0.0
+
+
+def _policy_sweep(V: np.ndarray, gT_pi: sparse.csr_matrix, r_pi: np.ndarray,
+                  order: np.ndarray, V_buf: np.ndarray, method: str, omega: float) -> float:
+    """
+    One policy-evaluation sweep V = r_pi + gT_pi @ V, updating V in place.
+    gT_pi = gamma * P_pi and r_pi = expected reward under the policy, both zero on terminal rows.
+    V_buf (|S|,) is a scratch buffer reused across sweeps. Returns max |ΔV|.
+    """
+    np.copyto(V_buf, V)
+    if _NUMBA_AVAILABLE:
+        if method == "jacobi":
+            return _policy_jacobi_numba(gT_pi.indptr, gT_pi.indices, gT_pi.data, r_pi, V, V_buf, order)
+        w = omega if method == "sor" else 1.0
+        return _policy_sweep_numba(gT_pi.indptr, gT_pi.indices, gT_pi.data, r_pi, V, V, order, w)
+
+    if method == "jacobi":
+        np.add(r_pi, gT_pi @ V, out=V)
+        return _max_abs_change(V_buf, V)
+
+    # Gauss-Seidel / SOR: later states see values already updated in this sweep
+    indptr, indices, data = gT_pi.indptr, gT_pi.indices, gT_pi.data
+    for s in order:
+        lo, hi = indptr[s], indptr[s + 1]
+        v_s = r_pi[s] + data[lo:hi] @ V[indices[lo:hi]]
+        if method == "sor":
+            v_s = (1.0 - omega) * V[s] + omega * v_s
+        V[s] = v_s
+    return _max_abs_change(V_buf, V)
+
+
+def _optimal_sweep(V: np.ndarray, gT: sparse.csr_matrix, R: np.ndarray,
+                   terminal_mask: np.ndarray, order: np.ndarray, Q: np.ndarray, V_buf: np.ndarray,
+                   method: str, omega: float) -> float:
+    """
+    One Bellman-optimality sweep with gT = gamma * T, updating V in place.
+    Q (|S|, A) and V_buf (|S|,) are scratch buffers reused across sweeps. Returns max |ΔV|.
+    """
+    np.copyto(V_buf, V)
+    if _NUMBA_AVAILABLE:
+        if method == "jacobi":
+            return _optimal_jacobi_numba(gT.indptr, gT.indices, gT.data, R, V, V_buf, order)
+        w = omega if method == "sor" else 1.0
+        return _optimal_sweep_numba(gT.indptr, gT.indices, gT.data, R, V, V, order, w)
+
+    if method == "jacobi":
+        np.add(R, (gT @ V).reshape(R.shape), out=Q)
+        Q[terminal_mask] = 0.0
+        np.max(Q, axis=1, out=V)
+        return _max_abs_change(V_buf, V)
+
+    indptr, indices, data = gT.indptr, gT.indices, gT.data
+    actions = range(R.shape[1])
+    action_buf = np.empty(R.shape[1], dtype=R.dtype)
+    for s in order:
+        v_s = _state_action_values(indptr, indices, data, R, V, s, actions, action_buf).max()
+        if method == "sor":
+            v_s = (1.0 - omega) * V[s] + omega * v_s
+        V[s] = v_s
+    return _max_abs_change(V_buf, V)
+
+
+_DEVICES = ("cpu", "cuda")
+
+
+def _check_device(device: str):
+    if device not in _DEVICES:
+        raise ValueError(f"Unknown device: {device} (expected one of {_DEVICES})")
+    if device == "cuda" and not _CUPY_AVAILABLE:
+        raise ImportError("device='cuda' requires cupy")
+
+
+def _policy_sweep_gpu(V, gT_pi, r_pi) -> float:
+    """Jacobi policy-evaluation sweep on CuPy arrays, updating V in place. Returns max |ΔV|."""
+    V_new = r_pi + gT_pi @ V
+    max_delta = float(cp.abs(V_new - V).max()) if V.size else 0.0
+    V[...] = V_new
+    return max_delta
+
+
+def _optimal_sweep_gpu(V, gT, R, terminal_mask) -> float:
+    """Jacobi Bellman-optimality sweep on CuPy arrays, updating V in place. Returns max |ΔV|."""
+    Q = R + (gT @ V).reshape(R.shape)
+    Q[terminal_mask] = 0.0
+    V_new = Q.max(axis=1)
+    max_delta = float(cp.abs(V_new - V).max()) if V.size else 0.0
+    V[...] = V_new
+    return max_delta
 
 
 def policy_evaluation(mdp_network: MDPNetwork,
@@ -10,48 +265,54 @@ def policy_evaluation(mdp_network: MDPNetwork,
                       gamma: float = 0.99,
                       theta: float = 1e-6,
                       max_iterations: int = 1000,
-                      verbose: bool = False) -> ValueTable:
+                      verbose: bool = False,
+                      method: Optional[str] = None,
+                      omega: float = 1.0,
+                      dtype: DTypeLike = np.float64,
+                      device: str = "cpu") -> ValueTable:
     """
     Evaluate V^π using R(s,a,s').
+    Bellman updates run on arrays: V = r_pi + gamma * P_pi @ V, with P_pi = sum_a pi(a|s) T[s,a]
+    built once from the nonzero entries of the policy only.
+    method: "jacobi" (synchronous), "gauss_seidel" (in place) or "sor" (in place, relaxation
+    0 < omega <= 1; omega = 1 is Gauss-Seidel). I - gamma * P_pi is not symmetric, so
+    over-relaxation (omega > 1) is not guaranteed to converge and is rejected.
+    method=None uses "gauss_seidel" when numba is available and "jacobi" otherwise.
+    dtype sets the working precision; np.float32 halves memory traffic, but theta must stay
+    above float32 resolution at the scale of V or the sweep never converges.
+    device="cuda" runs the sweeps on the GPU with CuPy (always Jacobi; method is ignored),
+    copying V back to the host once at the end.
     Set verbose=True to print progress.
     """
-    value_table = ValueTable()
-    states = mdp_network.states
-    for s in states:
-        value_table.set_value(s, 0.0)
+    method = _resolve_method(method)
+    if method == "sor" and not 0.0 < omega <= 1.0:
+        raise ValueError(f"omega must be in (0, 1] for policy evaluation, got {omega}")
+    _check_device(device)
+    if device == "cuda":
+        method = "jacobi"
+
+    states, idx, T, R, terminal_mask = mdp_network.as_dense(dtype)
+    Pi = _build_policy_matrix(policy, states, mdp_network.num_actions, dtype)
+    order = np.flatnonzero(~terminal_mask)
+    # policy and discount folded into one (|S|, |S|) matrix; R already holds the expected reward of each (s,a)
+    W = _policy_weights(Pi, terminal_mask)
+    gT_pi = (W @ (gamma * T)).astype(dtype).tocsr()
+    gT_pi.sort_indices()
+    r_pi = (W @ R.ravel()).astype(dtype)
+    V = np.zeros(len(states), dtype=dtype)
+    V_buf = np.empty_like(V)
+
+    if device == "cuda":
+        gT_d, r_d, V_d = cp_sparse.csr_matrix(gT_pi), cp.asarray(r_pi), cp.asarray(V)
 
     if verbose:
-        print(f"Policy evaluation started: {len(states)} states, gamma={gamma}, theta={theta}")
+        print(f"Policy evaluation started: {len(states)} states, gamma={gamma}, theta={theta}, method={method}, device={device}")
 
     for it in range(max_iterations):
-        max_delta = 0.0
-        for s in states:
-            if mdp_network.is_terminal_state(s):
-                value_table.set_value(s, 0.0)
-                continue
-
-            old_v = value_table.get_value(s)
-            new_v = 0.0
-            action_probs = policy.get_action_probabilities(s)
-
-            for a, pi_sa in action_probs.items():
-                if pi_sa <= 0:
-                    continue
-                # Sum over s': P * (R + gamma * V)
-                sa_val = 0.0
-                trans = mdp_network.get_transition_probabilities(s, a)
-                if not trans:
-                    # fallback: self-loop with default reward
-                    r = mdp_network.default_reward
-                    sa_val = r + gamma * value_table.get_value(s)
-                else:
-                    for sp, p in trans.items():
-                        r = mdp_network.get_transition_reward(s, a, sp)
-                        sa_val += p * (r + gamma * value_table.get_value(sp))
-                new_v += pi_sa * sa_val
-
-            value_table.set_value(s, new_v)
-            max_delta = max(max_delta, abs(new_v - old_v))
+        if device == "cuda":
+            max_delta = _policy_sweep_gpu(V_d, gT_d, r_d)
+        else:
+            max_delta = _policy_sweep(V, gT_pi, r_pi, order, V_buf, method, omega)
 
         if verbose and (it + 1) % 100 == 0:
             print(f"  Policy evaluation iteration {it + 1}: max_change = {max_delta:.6f}")
@@ -63,60 +324,56 @@ def policy_evaluation(mdp_network: MDPNetwork,
         if verbose:
             print(f"Policy evaluation reached maximum iterations ({max_iterations}), final max_change = {max_delta:.6f}")
 
-    return value_table
+    if device == "cuda":
+        V = cp.asnumpy(V_d)
+    return ValueTable.from_array(V, states)
 
 
 def optimal_value_iteration(mdp_network: MDPNetwork,
                             gamma: float = 0.99,
                             theta: float = 1e-6,
                             max_iterations: int = 1000,
-                            verbose: bool = False) -> Tuple[ValueTable, QTable]:
+                            verbose: bool = False,
+                            method: Optional[str] = None,
+                            omega: float = 1.0,
+                            dtype: DTypeLike = np.float64,
+                            device: str = "cpu") -> Tuple[ValueTable, QTable]:
     """
     Compute V* and Q* using R(s,a,s').
+    Bellman-optimality updates run on arrays: Q = R + gamma * T @ V, V = max_a Q, T sparse.
+    method: "jacobi" (synchronous), "gauss_seidel" (in place) or "sor" (in place, relaxation omega).
+    Over-relaxing the max operator is not a contraction, so "sor" only accepts 0 < omega <= 1.
+    method=None uses "gauss_seidel" when numba is available and "jacobi" otherwise.
+    dtype and device select the working precision and CPU/GPU backend (see policy_evaluation).
     Set verbose=True to print progress.
     """
-    value_table = ValueTable()
-    q_table = QTable()
-
-    states = mdp_network.states
+    method = _resolve_method(method)
+    if method == "sor" and not 0.0 < omega <= 1.0:
+        raise ValueError(f"omega must be in (0, 1] for value iteration, got {omega}")
+    _check_device(device)
+    if device == "cuda":
+        method = "jacobi"
+
+    states, idx, T, R, terminal_mask = mdp_network.as_dense(dtype)
     A = mdp_network.num_actions
+    order = np.flatnonzero(~terminal_mask)
+    gT = (gamma * T).astype(dtype).tocsr()
+    V = np.zeros(len(states), dtype=dtype)
+    V_buf = np.empty_like(V)
+    Q = np.empty_like(R)
 
-    for s in states:
-        value_table.set_value(s, 0.0)
-        for a in range(A):
-            q_table.set_q_value(s, a, 0.0)
+    if device == "cuda":
+        gT_d, R_d = cp_sparse.csr_matrix(gT), cp.asarray(R)
+        V_d, terminal_d = cp.asarray(V), cp.asarray(terminal_mask)
 
     if verbose:
-        print(f"Optimal value iteration started: {len(states)} states, {A} actions, gamma={gamma}, theta={theta}")
+        print(f"Optimal value iteration started: {len(states)} states, {A} actions, gamma={gamma}, theta={theta}, method={method}, device={device}")
 
     for it in range(max_iterations):
-        max_delta = 0.0
-        for s in states:
-            if mdp_network.is_terminal_state(s):
-                value_table.set_value(s, 0.0)
-                for a in range(A):
-                    q_table.set_q_value(s, a, 0.0)
-                continue
-
-            old_v = value_table.get_value(s)
-            action_vals = []
-
-            for a in range(A):
-                q = 0.0
-                trans = mdp_network.get_transition_probabilities(s, a)
-                if not trans:
-                    r = mdp_network.default_reward
-                    q = r + gamma * value_table.get_value(s)
-                else:
-                    for sp, p in trans.items():
-                        r = mdp_network.get_transition_reward(s, a, sp)
-                        q += p * (r + gamma * value_table.get_value(sp))
-                q_table.set_q_value(s, a, q)
-                action_vals.append(q)
-
-            new_v = max(action_vals) if action_vals else 0.0
-            value_table.set_value(s, new_v)
-            max_delta = max(max_delta, abs(new_v - old_v))
+        if device == "cuda":
+            max_delta = _optimal_sweep_gpu(V_d, gT_d, R_d, terminal_d)
+        else:
+            max_delta = _optimal_sweep(V, gT, R, terminal_mask, order, Q, V_buf, method, omega)
 
         if verbose and (it + 1) % 100 == 0:
             print(f"  Optimal value iteration {it + 1}: max_change = {max_delta:.6f}")
@@ -128,7 +385,276 @@ def optimal_value_iteration(mdp_network: MDPNetwork,
         if verbose:
             print(f"Optimal value iteration reached maximum iterations ({max_iterations}), final max_change = {max_delta:.6f}")
 
-    return value_table, q_table
+    if device == "cuda":
+        V = cp.asnumpy(V_d)
+
+    # Q from the converged V
+    np.add(R, (gT @ V).reshape(R.shape), out=Q)
+    Q[terminal_mask] = 0.0
+
+    return ValueTable.from_array(V, states), QTable.from_array(Q, states)
+
+
+def modified_policy_iteration(mdp_network: MDPNetwork,
+                              gamma: float = 0.99,
+                              m: int = 20,
+                              theta: float = 1e-6,
+                              max_iterations: int = 1000,
+                              verbose: bool = False,
+                              method: Optional[str] = None,
+                              omega: float = 1.0,
+                              dtype: DTypeLike = np.float64) -> Tuple[ValueTable, QTable]:
+    """
+    Compute V* and Q* using R(s,a,s') by modified policy iteration.
+    Each iteration improves the policy greedily from Q = R + gamma * T @ V, then runs up to
+    m policy-evaluation sweeps on T_pi (the rows s*A+pi(s) of T). Stops once the greedy
+    policy is stable and the Bellman residual max |max_a Q - V| is below theta.
+    m=0 is value iteration; large m approaches policy iteration.
+    method, omega and dtype select the evaluation sweeps and precision (see policy_evaluation).
+    Truncated over-relaxed evaluation can stall the outer loop, so "sor" only accepts
+    0 < omega <= 1, as in optimal_value_iteration.
+    Set verbose=True to print progress.
+    """
+    method = _resolve_method(method)
+    if method == "sor" and not 0.0 < omega <= 1.0:
+        raise ValueError(f"omega must be in (0, 1] for modified policy iteration, got {omega}")
+    if m < 0:
+        raise ValueError(f"m must be non-negative, got {m}")
+
+    states, idx, T, R, terminal_mask = mdp_network.as_dense(dtype)
+    nS, A = len(states), mdp_network.num_actions
+    order = np.flatnonzero(~terminal_mask)
+    # terminal rows of gamma * T and R zeroed once, so Q and T_pi need no masking afterwards
+    live = ~terminal_mask
+    gT = (sparse.diags(np.repeat(live, A).astype(dtype)) @ (gamma * T)).astype(dtype).tocsr()
+    R = R * live[:, None]
+    V = np.zeros(nS, dtype=dtype)
+    V_buf = np.empty_like(V)
+    Q = np.empty_like(R)
+    pi = np.full(nS, -1, dtype=np.int64)
+    tie_tol = 16 * np.finfo(dtype).eps
+
+    if verbose:
+        print(f"Modified policy iteration started: {nS} states, {A} actions, gamma={gamma}, theta={theta}, m={m}, method={method}")
+
+    for it in range(max_iterations):
+        # policy improvement; an action only changes if another is better by more than
+        # rounding error, so ties do not make the policy flip between equal actions forever
+        np.add(R, (gT @ V).reshape(R.shape), out=Q)
+        np.copyto(V_buf, V)
+        np.max(Q, axis=1, out=V)
+        q_pi = Q[np.arange(nS), np.maximum(pi, 0)]
+        improve = (pi < 0) | (q_pi < V - tie_tol * np.maximum(1.0, np.abs(V)))
+        pi[improve] = Q[improve].argmax(axis=1)
+        changed = int(improve.sum())
+        residual = _max_abs_change(V_buf, V)
+
+        if verbose and (it + 1) % 10 == 0:
+            print(f"  Modified policy iteration {it + 1}: max_change = {residual:.6f}, policy_changes = {changed}")
+        if changed == 0 and residual < theta:
+            if verbose:
+                print(f"Modified policy iteration converged after {it + 1} iterations, final max_change = {residual:.6f}")
+            break
+
+        # partial evaluation of the greedy policy
+        rows = np.arange(nS) * A + pi
+        gT_pi = gT[rows]
+        r_pi = R[np.arange(nS), pi]
+        for _ in range(m):
+            if _policy_sweep(V, gT_pi, r_pi, order, V_buf, method, omega) < theta:
+                break
+    else:
+        if verbose:
+            print(f"Modified policy iteration reached maximum iterations ({max_iterations}), final max_change = {residual:.6f}")
+
+    # Q from the final V
+    np.add(R, (gT @ V).reshape(R.shape), out=Q)
+
+    return ValueTable.from_array(V, states), QTable.from_array(Q, states)
+
+
+def _sample_transitions(next_idx: np.ndarray, cdf: np.ndarray, rewards: np.ndarray,
+                        s: np.ndarray, a: np.ndarray, u: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse-CDF draw of (s', r) for every (s[k], a[k]) pair given uniforms u[k] in [0, 1)."""
+    k = (cdf[s, a] <= u[:, None]).sum(axis=1)
+    return next_idx[s, a, k], rewards[s, a, k]
+
+
+if _NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _q_learning_episodes_numba(Q, best_a, best_q, next_idx, cdf, rewards, terminal_mask, start_idx,
+                                   alpha, gamma, epsilon, num_episodes, max_steps, seed):
+        """
+        Single-agent Q-learning over num_episodes episodes, updating Q in place. Returns the last episode's steps.
+        best_a / best_q cache argmax_a Q[s] / max_a Q[s] and are kept in sync with each update.
+        """
+        np.random.seed(seed)
+        A = Q.shape[1]
+        k_max = cdf.shape[2]
+        steps = 0
+        for _ in range(num_episodes):
+            s = start_idx[np.random.randint(start_idx.shape[0])]
+            steps = 0
+            while steps < max_steps and not terminal_mask[s]:
+                steps += 1
+
+                # epsilon-greedy
+                if np.random.random() < epsilon:
+                    a = np.random.randint(A)
+                else:
+                    a = best_a[s]
+
+                # inverse-CDF draw of s'
+                u = np.random.random()
+                k = 0
+                while k < k_max - 1 and cdf[s, a, k] <= u:
+                    k += 1
+                sp = next_idx[s, a, k]
+
+                target = rewards[s, a, k]
+                if not terminal_mask[sp]:
+                    target += gamma * best_q[sp]
+                q_new = Q[s, a] + alpha * (target - Q[s, a])
+                Q[s, a] = q_new
+
+                # the cached argmax only needs a rescan when the best action's value drops
+                if q_new > best_q[s] or (q_new == best_q[s] and a < best_a[s]):
+                    best_a[s] = a
+                    best_q[s] = q_new
+                elif a == best_a[s]:
+                    b_best = 0
+                    for b in range(1, A):
+                        if Q[s, b] > Q[s, b_best]:
+                            b_best = b
+                    best_a[s] = b_best
+                    best_q[s] = Q[s, b_best]
+                s = sp
+        return steps
+
+
+def _q_learning_batched(Q: np.ndarray,
+                        next_idx: np.ndarray,
+                        cdf: np.ndarray,
+                        rewards: np.ndarray,
+                        terminal_mask: np.ndarray,
+                        sample_starts,
+                        rng: np.random.Generator,
+                        alpha: float,
+                        gamma: float,
+                        epsilon: float,
+                        num_episodes: int,
+                        max_steps_per_episode: int,
+                        num_envs: int,
+                        verbose: bool):
+    """
+    Q-learning with num_envs agents in lockstep on the shared Q array (updated in place).
+    sample_starts(n) returns n start-state indices.
+    Per-state argmax / max of Q are cached and refreshed only for the states updated each step.
+    """
+    if num_episodes <= 0:
+        return
+    A = Q.shape[1]
+    n_envs = max(1, min(num_envs, num_episodes))
+    cur = sample_starts(n_envs)
+    ep_steps = np.zeros(n_envs, dtype=np.int64)
+    active = np.ones(n_envs, dtype=bool)
+    episodes_started = n_envs
+    episodes_done = 0
+
+    Q_flat = Q.reshape(-1)  # view: Q_flat[s * A + a] is Q[s, a]
+    best_a = Q.argmax(axis=1)
+    best_q = Q.max(axis=1)
+
+    # random numbers are drawn in blocks of rng_block steps for all agents at once
+    rng_block = max(1, min(max_steps_per_episode, 1024))
+    k = rng_block
+
+    while active.any():
+        # episodes end on a terminal state or at the step limit
+        done = np.flatnonzero(active & (terminal_mask[cur] | (ep_steps >= max_steps_per_episode)))
+        if len(done):
+            for i in done:
+                episodes_done += 1
+                if verbose and episodes_done % 1000 == 0:
+                    print(f"  Q-Learning episode {episodes_done}/{num_episodes}: avg_q_value = {Q.mean():.4f}, last_episode_steps = {ep_steps[i]}")
+            n_restart = min(len(done), num_episodes - episodes_started)
+            restart, retire = done[:n_restart], done[n_restart:]
+            cur[restart] = sample_starts(n_restart)
+            ep_steps[restart] = 0
+            episodes_started += n_restart
+            active[retire] = False
+            continue
+
+        if k == rng_block:
+            explore_buf = rng.random((rng_block, n_envs)) < epsilon
+            action_buf = rng.integers(0, A, (rng_block, n_envs))
+            trans_buf = rng.random((rng_block, n_envs))
+            k = 0
+
+        agents = np.flatnonzero(active)
+        s = cur[agents]
+
+        # epsilon-greedy
+        a = np.where(explore_buf[k, agents], action_buf[k, agents], best_a[s])
+
+        # one-step transition and reward
+        sp, r = _sample_transitions(next_idx, cdf, rewards, s, a, trans_buf[k, agents])
+        k += 1
+
+        # TD update; agents that share an (s,a) pair have their TD errors averaged, so the
+        # pair takes one alpha-step rather than one per agent (which diverges)
+        target = r + gamma * best_q[sp] * ~terminal_mask[sp]
+        pairs, inverse, counts = np.unique(s * A + a, return_inverse=True, return_counts=True)
+        td_error = np.bincount(inverse, weights=target - Q[s, a]) / counts
+        Q_flat[pairs] += alpha * td_error
+        best_a[s] = Q[s].argmax(axis=1)
+        best_q[s] = Q[s, best_a[s]]
+
+        cur[agents] = sp
+        ep_steps[agents] += 1
+
+
+def _run_q_learning(Q: np.ndarray,
+                    next_idx: np.ndarray,
+                    cdf: np.ndarray,
+                    rewards: np.ndarray,
+                    terminal_mask: np.ndarray,
+                    start_idx: np.ndarray,
+                    seed: Any,
+                    alpha: float,
+                    gamma: float,
+                    epsilon: float,
+                    num_episodes: int,
+                    max_steps_per_episode: int,
+                    num_envs: int,
+                    verbose: bool) -> np.ndarray:
+    """
+    Run num_episodes of Q-learning on Q in place and return it.
+    Start states are drawn uniformly from start_idx (as in sample_start_state).
+    Only takes arrays, so it can also run in a joblib worker.
+    """
+    rng = np.random.default_rng(seed)
+
+    if _NUMBA_AVAILABLE and num_envs <= 1:
+        best_a = Q.argmax(axis=1)
+        best_q = Q.max(axis=1)
+        episodes_done = 0
+        while episodes_done < num_episodes:
+            # compiled in blocks of 1000 episodes so progress can still be reported
+            n = min(1000, num_episodes - episodes_done)
+            last_steps = _q_learning_episodes_numba(Q, best_a, best_q, next_idx, cdf, rewards, terminal_mask,
+                                                    start_idx, alpha, gamma, epsilon, n, max_steps_per_episode,
+                                                    int(rng.integers(0, 2 ** 31 - 1)))
+            episodes_done += n
+            if verbose and episodes_done % 1000 == 0:
+                print(f"  Q-Learning episode {episodes_done}/{num_episodes}: avg_q_value = {Q.mean():.4f}, last_episode_steps = {last_steps}")
+    else:
+        def sample_starts(n: int) -> np.ndarray:
+            return start_idx[rng.integers(0, len(start_idx), size=n)]
+
+        _q_learning_batched(Q, next_idx, cdf, rewards, terminal_mask, sample_starts, rng,
+                            alpha, gamma, epsilon, num_episodes, max_steps_per_episode, num_envs, verbose)
+    return Q
 
 
 def q_learning(mdp_network: MDPNetwork,
@@ -138,72 +664,68 @@ def q_learning(mdp_network: MDPNetwork,
                num_episodes: int = 10000,
                max_steps_per_episode: int = 1000,
                seed: Optional[int] = None,
-               verbose: bool = False) -> Tuple[QTable, ValueTable]:
+               verbose: bool = False,
+               num_envs: int = 1,
+               dtype: DTypeLike = np.float64,
+               n_jobs: int = 1) -> Tuple[QTable, ValueTable]:
     """
-    Tabular Q-learning with R(s,a,s') via mdp.sample_step.
+    Tabular Q-learning with R(s,a,s'), sampling transitions from precomputed CDF tables.
+    Runs num_envs agents in lockstep on one shared Q array; epsilon-greedy choices and
+    TD updates are vectorised across agents. An agent starts a new episode when its
+    previous one ends, until num_episodes episodes have been run in total.
+    num_envs=1 is plain sequential Q-learning, run as a compiled loop when numba is available.
+    n_jobs != 1 splits the episodes across independent joblib worker processes
+    (-1 = all cores) and averages their Q-tables at the end.
+    dtype sets the precision of the Q array.
     Set verbose=True to print progress.
     """
     rng = np.random.default_rng(seed)
-    q_table = QTable()
-    value_table = ValueTable()
-
-    states = mdp_network.states
+    states, idx, _, _, terminal_mask = mdp_network.as_dense()
     A = mdp_network.num_actions
-
-    for s in states:
-        value_table.set_value(s, 0.0)
-        for a in range(A):
-            q_table.set_q_value(s, a, 0.0)
+    next_idx, cdf, rewards = mdp_network.as_sampling_tables()
+    start_idx = np.array([idx[s] for s in mdp_network.start_states], dtype=np.int64)
+    # row |S| is the absorbing zero-value state for successors outside `states`
+    Q = np.zeros((len(states) + 1, A), dtype=dtype)
+    absorbing_mask = np.append(terminal_mask, True)
 
     if verbose:
-        print(f"Q-Learning started: {len(states)} states, {A} actions, {num_episodes} episodes")
+        print(f"Q-Learning started: {len(states)} states, {A} actions, {num_episodes} episodes, {num_envs} envs")
         print(f"  Parameters: alpha={alpha}, gamma={gamma}, epsilon={epsilon}")
 
-    for ep in range(num_episodes):
-        s = mdp_network.sample_start_state(rng)
-        episode_steps = 0
-
-        for _ in range(max_steps_per_episode):
-            if mdp_network.is_terminal_state(s):
-                break
-            episode_steps += 1
-
-            # epsilon-greedy
-            if rng.random() < epsilon:
-                a = int(rng.integers(0, A))
-            else:
-                a, _ = q_table.get_best_action(s)
-
-            # one-step transition and reward
-            sp, r = mdp_network.sample_step(s, a, rng)
-
-            # TD update
-            q_sa = q_table.get_q_value(s, a)
-            if mdp_network.is_terminal_state(sp):
-                target = r
-            else:
-                _, max_next_q = q_table.get_best_action(sp)
-                target = r + gamma * max_next_q
-            q_table.set_q_value(s, a, q_sa + alpha * (target - q_sa))
-
-            s = sp
-
-        if verbose and (ep + 1) % 1000 == 0:
-            total_q = sum(q_table.get_q_value(s, a) for s in states for a in range(A))
-            avg_q = total_q / (len(states) * A)
-            print(f"  Q-Learning episode {ep + 1}/{num_episodes}: avg_q_value = {avg_q:.4f}, last_episode_steps = {episode_steps}")
+    if n_jobs == 1:
+        _run_q_learning(Q, next_idx, cdf, rewards, absorbing_mask, start_idx, rng,
+                        alpha, gamma, epsilon, num_episodes, max_steps_per_episode, num_envs, verbose)
+    else:
+        if not _JOBLIB_AVAILABLE:
+            raise ImportError("n_jobs != 1 requires joblib")
+        n_workers = max(1, min(effective_n_jobs(n_jobs), num_episodes))
+        shares = [len(chunk) for chunk in np.array_split(np.arange(num_episodes), n_workers)]
+        worker_seeds = rng.integers(0, 2 ** 63 - 1, size=n_workers)
+        if verbose:
+            print(f"  Running {n_workers} workers with {shares} episodes")
+        Q_parts = Parallel(n_jobs=n_workers, backend="loky")(
+            delayed(_run_q_learning)(Q.copy(), next_idx, cdf, rewards, absorbing_mask, start_idx, int(ws),
+                                     alpha, gamma, epsilon, share, max_steps_per_episode, num_envs, False)
+            for ws, share in zip(worker_seeds, shares)
+        )
+        Q = np.mean(Q_parts, axis=0).astype(dtype)
 
     # derive V(s) = max_a Q(s,a)
-    for s in states:
-        if mdp_network.is_terminal_state(s):
-            value_table.set_value(s, 0.0)
-        else:
-            _, best_q = q_table.get_best_action(s)
-            value_table.set_value(s, best_q)
+    Q = Q[:len(states)]
+    V = Q.max(axis=1)
+    V[terminal_mask] = 0.0
 
     if verbose:
         print("Q-Learning completed")
-    return q_table, value_table
+    return QTable.from_array(Q, states), ValueTable.from_array(V, states)
+
+
+def _policy_transition_matrix(T: sparse.csr_matrix, Pi: sparse.csr_matrix, terminal_mask: np.ndarray) -> sparse.csr_matrix:
+    """
+    P_pi[s, s'] = sum_a pi(a|s) * P(s'|s,a) as an (|S|, |S|) CSR matrix.
+    Rows of terminal states are zero (they do not propagate).
+    """
+    return (_policy_weights(Pi, terminal_mask) @ T).tocsr()
 
 
 def compute_occupancy_measure(mdp_network: MDPNetwork,
@@ -211,108 +733,64 @@ def compute_occupancy_measure(mdp_network: MDPNetwork,
                               gamma: float = 0.99,
                               theta: float = 1e-6,
                               max_iterations: int = 1000,
-                              verbose: bool = False) -> ValueTable:
+                              verbose: bool = False,
+                              closed_form: bool = False,
+                              dtype: DTypeLike = np.float64) -> ValueTable:
     """
     Compute occupancy measure for a given policy in MDP (supports probabilistic policies).
     Returns a ValueTable containing the expected cumulative frequency of visiting each state.
+    Iterates mu_{k+1} = gamma * P_pi^T mu_k and accumulates d = sum_k mu_k;
+    closed_form=True instead solves (I - gamma * P_pi^T) d = mu_0 directly.
+    dtype sets the working precision.
     Set verbose=True to print progress.
     """
-    # Initialize occupancy measure table
-    occupancy_table = ValueTable()
-
-    # Get all states
-    states = mdp_network.states
-
-    # Initialize occupancy measures to zero
-    for state in states:
-        occupancy_table.set_value(state, 0.0)
-
-    # Initialize current state distribution (uniform over start states)
-    current_distribution = {}
+    states, idx, T, R, terminal_mask = mdp_network.as_dense(dtype)
     start_states = list(mdp_network.start_states)
 
     if not start_states:
         if verbose:
             print("Warning: No start states found")
-        return occupancy_table
+        return ValueTable.from_array(np.zeros(len(states)), states)
 
     # Uniform initial distribution over start states
-    initial_prob = 1.0 / len(start_states)
-    for state in start_states:
-        current_distribution[state] = initial_prob
+    mu = np.zeros(len(states), dtype=dtype)
+    mu[[idx[s] for s in start_states if s in idx]] = 1.0 / len(start_states)
 
     if verbose:
         print(f"Occupancy measure computation started: {len(states)} states, {len(start_states)} start states")
         print(f"  Parameters: gamma={gamma}, theta={theta}")
 
-    # Iterative computation of occupancy measures
-    for iteration in range(max_iterations):
-        max_change = 0.0
-        next_distribution = {state: 0.0 for state in states}
-
-        # For each state in current distribution
-        for state, state_prob in current_distribution.items():
-            if state_prob <= 0:
-                continue
-
-            # Update occupancy measure for this state (including terminal states)
-            old_occupancy = occupancy_table.get_value(state)
-            new_occupancy = old_occupancy + state_prob
-            occupancy_table.set_value(state, new_occupancy)
-
-            # Track maximum change for convergence
-            change = abs(new_occupancy - old_occupancy)
-            max_change = max(max_change, change)
-
-            # Terminal states don't propagate probability to next states
-            if mdp_network.is_terminal_state(state):
-                continue
+    Pi = _build_policy_matrix(policy, states, mdp_network.num_actions, dtype)
+    gPT = (gamma * _policy_transition_matrix(T, Pi, terminal_mask).T).astype(dtype).tocsr()
 
-            # Get action probabilities from policy
-            action_probs = policy.get_action_probabilities(state)
-
-            # For each possible action
-            for action, action_prob in action_probs.items():
-                if action_prob <= 0:
-                    continue
-
-                # Get transition probabilities for this state-action pair
-                transition_probs = mdp_network.get_transition_probabilities(state, action)
-
-                if not transition_probs:
-                    # No transitions defined, assume staying in same state
-                    transition_probs = {state: 1.0}
-
-                # Propagate probability to next states with discount factor
-                for next_state, transition_prob in transition_probs.items():
-                    # Discounted probability of reaching next state
-                    propagated_prob = state_prob * action_prob * transition_prob * gamma
-                    next_distribution[next_state] += propagated_prob
+    if closed_form:
+        occupancy = spsolve((sparse.identity(len(states), format="csc") - gPT).tocsc(), mu)
+        occupancy = np.atleast_1d(occupancy)
+        if verbose:
+            print(f"Occupancy measure solved in closed form, total_occupancy = {occupancy.sum():.4f}")
+        return ValueTable.from_array(occupancy, states)
 
-        # Update current distribution for next iteration
-        current_distribution = next_distribution
+    occupancy = np.zeros(len(states), dtype=dtype)
+    for iteration in range(max_iterations):
+        # Terminal states keep their occupancy but do not propagate mass
+        occupancy += mu
+        max_change = float(mu.max()) if len(mu) else 0.0
+        mu = gPT @ mu
 
-        # Print debug info every 100 iterations
         if verbose and (iteration + 1) % 100 == 0:
-            total_occupancy = sum(occupancy_table.get_value(state) for state in states)
-            print(f"  Occupancy measure iteration {iteration + 1}: max_change = {max_change:.6f}, total_occupancy = {total_occupancy:.4f}")
+            print(f"  Occupancy measure iteration {iteration + 1}: max_change = {max_change:.6f}, total_occupancy = {occupancy.sum():.4f}")
 
-        # Check for convergence
         if max_change < theta:
             if verbose:
-                total_occupancy = sum(occupancy_table.get_value(state) for state in states)
                 print(f"Occupancy measure computation converged after {iteration + 1} iterations")
-                print(f"  Final: max_change = {max_change:.6f}, total_occupancy = {total_occupancy:.4f}")
+                print(f"  Final: max_change = {max_change:.6f}, total_occupancy = {occupancy.sum():.4f}")
             break
     else:
         if verbose:
-            total_occupancy = sum(occupancy_table.get_value(state) for state in states)
             print(f"Occupancy measure computation reached maximum iterations ({max_iterations})")
-            print(f"  Final: max_change = {max_change:.6f}, total_occupancy = {total_occupancy:.4f}")
-
-    # Terminal states keep their occupancy; no zeroing.
+            print(f"  Final: max_change = {max_change:.6f}, total_occupancy = {occupancy.sum():.4f}")
 
-    return occupancy_table
+    return ValueTable.from_array(occupancy, states)
 
 
 def compute_reward_distribution(mdp_network: MDPNetwork,
@@ -329,32 +807,32 @@ def compute_reward_distribution(mdp_network: MDPNetwork,
         print(f"Computing reward distribution with delta precision: {delta:.2e}")
 
     count_dist = RewardDistributionTable(delta=delta)
-    states = mdp_network.states
-    processed_states = 0
-
-    for s in states:
-        occ = occupancy_table.get_value(s)
-        if occ <= 0:
-            continue
-        processed_states += 1
-
-        # terminal states contribute occupancy but have no outgoing transitions
-        if mdp_network.is_terminal_state(s):
-            continue
-
-        action_probs = policy.get_action_probabilities(s)
-        for a, pi_sa in action_probs.items():
-            if pi_sa <= 0:
-                continue
-            trans = mdp_network.get_transition_probabilities(s, a)
-            if not trans:
-                # no outgoing: self-loop with default reward
-                r = mdp_network.default_reward
-                count_dist.add_count(r, occ * pi_sa)  # weight fully to that reward
-            else:
-                for sp, p in trans.items():
-                    r = mdp_network.get_transition_reward(s, a, sp)
-                    count_dist.add_count(r, occ * pi_sa * p)
+    states, idx, _, _, terminal_mask = mdp_network.as_dense()
+    A = mdp_network.num_actions
+    Pi = _build_policy_matrix(policy, states, A)
+
+    occ = np.array([occupancy_table.get_value(s) for s in states], dtype=np.float64)
+    processed_states = int((occ > 0).sum())
+
+    # terminal states contribute occupancy but have no outgoing transitions;
+    # W[s, a] = Occ(s) * pi(a|s) stays sparse, so the cost follows the stored transitions
+    occ_out = np.where((occ > 0) & ~terminal_mask, occ, 0.0)
+    W = sparse.csr_matrix(Pi.multiply(occ_out[:, None]))
+    i, a, _, p, r = _transition_triples(mdp_network, idx)
+    # W[i, a] with empty i is a sparse 1x0 matrix rather than an array, so guard that case
+    weights = np.asarray(W[i, a], dtype=np.float64).ravel() * p if len(i) else np.zeros(0)
+
+    # (s,a) pairs without transitions self-loop with default_reward
+    W = W.tocoo()
+    has_succ = np.bincount(i * A + a, minlength=len(states) * A) > 0
+    loops = ~has_succ[W.row * A + W.col]
+    rewards = np.concatenate([r, np.full(int(loops.sum()), mdp_network.default_reward)])
+    weights = np.concatenate([weights, W.data[loops]])
+
+    live = weights > 0
+    reward_values, inverse = np.unique(rewards[live], return_inverse=True)
+    for r, w in zip(reward_values, np.bincount(inverse, weights=weights[live], minlength=len(reward_values))):
+        count_dist.add_count(float(r), float(w))
 
     if verbose:
         print(f"Processed {processed_states} states with positive occupancy")
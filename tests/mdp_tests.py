@@ -1,9 +1,15 @@
+import contextlib
+import io
 import os
+from typing import Dict
+
+import numpy as np
 
 from mdp_network.computes import compute_information_surprise
 from mdp_network.plots import plot_values, plot_policy, plot_q_values
 from mdp_network.mdp_tables import q_table_to_policy, create_random_policy
 from mdp_network.solvers import *
+from mdp_network.solvers import _JOBLIB_AVAILABLE
 from mdp_network.samplers import deterministic_mdp_sampling
 from customised_minigrid_env.customised_minigrid_env import CustomMiniGridEnv
 
@@ -15,6 +21,38 @@ def ensure_output_dir(output_dir: str = "./outputs/mdp_tests"):
     return output_dir
 
 
+def make_uniform_cost_grid(size: int, slip: float = 0.0) -> MDPNetwork:
+    """
+    size x size grid with step reward -1 everywhere and the goal in the far corner.
+    Each move goes sideways with probability slip per side. Many actions tie exactly
+    or up to rounding, which is what makes policy-based solvers flip between them.
+    """
+    moves = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+    transitions = {}
+    for y in range(size):
+        for x in range(size):
+            s = y * size + x
+            transitions[str(s)] = {}
+            for a in range(len(moves)):
+                outcomes = {}
+                for b, p in [(a, 1.0 - 2 * slip), ((a + 1) % 4, slip), ((a + 3) % 4, slip)]:
+                    if p <= 0:
+                        continue
+                    dx, dy = moves[b]
+                    nx = min(max(x + dx, 0), size - 1)
+                    ny = min(max(y + dy, 0), size - 1)
+                    outcomes.setdefault(str(ny * size + nx), {"p": 0.0, "r": -1.0})["p"] += p
+                transitions[str(s)][str(a)] = outcomes
+    return MDPNetwork(config_data={
+        "num_actions": len(moves),
+        "states": list(range(size * size)),
+        "start_states": [0],
+        "terminal_states": [size * size - 1],
+        "default_reward": -1.0,
+        "transitions": transitions,
+    })
+
+
 # Unit tests and visualization script
 if __name__ == "__main__":
     print("=== MDP Solver Unit Tests with Network Visualization ===\n")
@@ -76,6 +114,92 @@ if __name__ == "__main__":
     theta = 1e-6
     max_iterations = 1000
 
+    # An MDP without stored transitions: every (s,a) self-loops with default_reward
+    print("=== MDP without stored transitions ===")
+    empty_mdp = MDPNetwork(config_data={
+        "num_actions": 2,
+        "states": [0, 1],
+        "start_states": [0],
+        "terminal_states": [1],
+        "default_reward": -0.5,
+        "transitions": {},
+    })
+    empty_policy = create_random_policy(empty_mdp)
+    empty_iterations = 5000  # -0.5 / (1 - gamma) needs ~1300 sweeps to settle within theta
+    empty_values = {
+        "policy_evaluation": policy_evaluation(empty_mdp, empty_policy, gamma, theta, empty_iterations),
+        "optimal_value_iteration": optimal_value_iteration(empty_mdp, gamma, theta, empty_iterations)[0],
+        "optimal_value_iteration (jacobi)": optimal_value_iteration(empty_mdp, gamma, theta, empty_iterations,
+                                                                    method="jacobi")[0],
+        "modified_policy_iteration": modified_policy_iteration(empty_mdp, gamma, theta=theta,
+                                                               max_iterations=empty_iterations)[0],
+    }
+    for name, values in empty_values.items():
+        print(f"  {name}: V(0) = {values.get_value(0):.6f}, V(1) = {values.get_value(1):.6f}")
+        assert abs(values.get_value(0) - (-0.5 / (1 - gamma))) <= gamma / (1 - gamma) * theta, \
+            f"{name} lost the default reward on an MDP without transitions"
+        assert values.get_value(1) == 0.0, f"{name} gave the terminal state a value"
+    empty_occupancy = compute_occupancy_measure(empty_mdp, empty_policy, gamma, theta, max_iterations)
+    empty_counts, _ = compute_reward_distribution(empty_mdp, empty_occupancy, empty_policy)
+    print(f"  Reward distribution: {empty_counts.get_all_rewards()}, total = {empty_counts.get_total_count():.6f}")
+    assert empty_counts.get_all_rewards() == [-0.5], "Reward distribution lost the default reward"
+    assert abs(empty_counts.get_total_count() - empty_occupancy.get_value(0)) <= theta, \
+        "Reward distribution does not weight the default reward by occupancy"
+
+    # Modified Policy Iteration on tie-heavy grids: near-tied actions must not keep the
+    # greedy policy flipping, so the solver has to stop before max_iterations
+    print("\n=== Modified Policy Iteration on uniform-cost grids ===")
+    for size, slip, dtype, mpi_theta in [(6, 0.0, np.float64, theta), (25, 0.1, np.float32, 1e-3)]:
+        grid = make_uniform_cost_grid(size, slip)
+        vi_values, _ = optimal_value_iteration(grid, gamma, mpi_theta, max_iterations, dtype=dtype)
+        for m in (0, 5, 20):
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                mpi_values, _ = modified_policy_iteration(grid, gamma, m=m, theta=mpi_theta, max_iterations=500,
+                                                          verbose=True, dtype=dtype)
+            v_diff = max(abs(mpi_values.get_value(s) - vi_values.get_value(s)) for s in grid.states)
+            converged = "converged" in log.getvalue()
+            print(f"  {size}x{size} grid, slip={slip}, {np.dtype(dtype).name}, m={m}: "
+                  f"converged={converged}, max |V - V_VI| = {v_diff:.2e}")
+            assert converged, f"Modified policy iteration did not terminate on the {size}x{size} grid (m={m})"
+            # both solvers stop within gamma / (1 - gamma) * theta of V*
+            assert v_diff <= gamma / (1 - gamma) * mpi_theta, \
+                f"Modified policy iteration disagrees with value iteration on the {size}x{size} grid"
+
+    # MDPNetwork caches its array form; every mutation must be visible to the next solve.
+    # Each step is compared with a fresh, uncached copy of the mutated MDP.
+    print("\n=== MDPNetwork cache invalidation ===")
+    cached_mdp = MDPNetwork(config_path="../mdp_network/mdps/chain-3.json")
+
+    def solve_values(network: MDPNetwork) -> Dict[int, float]:
+        values, _ = optimal_value_iteration(network, gamma, theta, max_iterations)
+        return {s: values.get_value(s) for s in network.states}
+
+    def edit_graph_reward(network: MDPNetwork):
+        network.graph[0][2]["transitions"][0]["r"] = 20.0
+        network.invalidate_cache()
+
+    mutations = [
+        ("update_transition_reward", lambda n: n.update_transition_reward(1, 1, 2, 2.0)),
+        ("add_transition + renormalize_action",
+         lambda n: (n.add_transition(0, 2, 0, 1.0, reward=10.0), n.renormalize_action(0, 0))),
+        ("terminal_states.add", lambda n: n.terminal_states.add(1)),
+        ("add_state without transitions", lambda n: n.add_state(3)),
+        ("default_reward edit", lambda n: setattr(n, "default_reward", -0.5)),
+        ("graph edit + invalidate_cache", edit_graph_reward),
+    ]
+    before = solve_values(cached_mdp)
+    for name, mutate in mutations:
+        mutate(cached_mdp)
+        after = solve_values(cached_mdp)
+        expected = solve_values(MDPNetwork.from_portable(cached_mdp.to_portable()))
+        stale_diff = max(abs(after[s] - expected[s]) for s in expected)
+        changed = any(abs(before.get(s, 0.0) - expected[s]) > theta for s in expected)
+        print(f"  {name}: max |V_cached - V_fresh| = {stale_diff:.2e}, V* changed = {changed}")
+        assert changed, f"{name} did not change V*, so it cannot detect a stale cache"
+        assert stale_diff <= theta, f"Solve after {name} used a stale cached model"
+        before = after
+
     # Run tests for each MDP
     for i, (mdp, prefix) in enumerate(zip(mdps, prefixes)):
         print(f"\n{'=' * 50}")
@@ -153,6 +277,34 @@ if __name__ == "__main__":
             print("Optimal Greedy Policy:")
             print(greedy_policy)
 
+        # Test 2b: Modified Policy Iteration must agree with optimal value iteration
+        print("\n=== Test 2b: Modified Policy Iteration ===")
+        for m in (0, 20):
+            mpi_values, mpi_q_table = modified_policy_iteration(mdp, gamma, m=m, theta=theta,
+                                                                max_iterations=max_iterations)
+            v_diff = max(abs(mpi_values.get_value(s) - opt_values.get_value(s)) for s in mdp.states)
+            q_diff = max(abs(mpi_q_table.get_q_value(s, a) - opt_q_table.get_q_value(s, a))
+                         for s in mdp.states for a in range(mdp.num_actions))
+            print(f"  m={m}: max |V - V_VI| = {v_diff:.2e}, max |Q - Q_VI| = {q_diff:.2e}")
+            # a residual below theta only bounds the error by gamma / (1 - gamma) * theta; Gauss-Seidel
+            # sweeps usually land closer, but the Jacobi default used without numba does not
+            tol = gamma / (1 - gamma) * theta
+            assert v_diff <= tol and q_diff <= tol, f"Modified policy iteration (m={m}) disagrees with value iteration"
+
+        for solver in (modified_policy_iteration, optimal_value_iteration):
+            try:
+                solver(mdp, gamma, method="sor", omega=1.5)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"{solver.__name__} accepted over-relaxed SOR (omega=1.5)")
+        try:
+            policy_evaluation(mdp, random_policy, gamma, method="sor", omega=1.5)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("policy_evaluation accepted over-relaxed SOR (omega=1.5)")
+
         # Test 3: Q-Learning
         print("\n=== Test 3: Q-Learning ===")
         ql_q_table, ql_values = q_learning(
@@ -188,6 +340,33 @@ if __name__ == "__main__":
             print("Q-Learning Policy:")
             print(ql_policy)
 
+        # Test 3b: Lockstep Q-Learning with many agents must stay close to optimal value iteration
+        print("\n=== Test 3b: Batched Q-Learning (256 envs) ===")
+        _, ql_batched_values = q_learning(
+            mdp, alpha=0.1, gamma=gamma, epsilon=0.1,
+            num_episodes=5000, max_steps_per_episode=100, seed=42, num_envs=256)
+        non_terminal = [s for s in mdp.states if not mdp.is_terminal_state(s)]
+        batched_diff = max(abs(ql_batched_values.get_value(s) - opt_values.get_value(s)) for s in non_terminal)
+        value_scale = max(abs(opt_values.get_value(s)) for s in non_terminal)
+        print(f"  Max |V - V*| over non-terminal states: {batched_diff:.6f} (value scale {value_scale:.6f})")
+        assert batched_diff <= 0.25 * value_scale, "Batched Q-learning drifted away from optimal value iteration"
+
+        # Test 3c: Q-learning split across joblib worker processes (joblib is optional)
+        print("\n=== Test 3c: Parallel Q-Learning (n_jobs=2) ===")
+        if _JOBLIB_AVAILABLE:
+            par_q_table, par_values = q_learning(
+                mdp, alpha=0.1, gamma=gamma, epsilon=0.1,
+                num_episodes=200, max_steps_per_episode=100, seed=42, n_jobs=2)
+            assert set(par_q_table.get_all_states()) == set(mdp.states), "Parallel Q-table is missing states"
+            assert all(len(par_q_table.get_all_actions(s)) == mdp.num_actions for s in mdp.states), \
+                "Parallel Q-table rows do not cover every action"
+            assert set(par_values.get_all_states()) == set(mdp.states), "Parallel value table is missing states"
+            assert all(par_values.get_value(s) == 0.0 for s in mdp.terminal_states), \
+                "Parallel Q-learning gave a terminal state a value"
+            print(f"  {len(mdp.states)} states x {mdp.num_actions} actions, terminal values are 0")
+        else:
+            print("  Skipped: joblib is not installed")
+
         # Test 4: Occupancy Measure
         print("\n=== Test 4: Occupancy Measure ===")
         occupancy = compute_occupancy_measure(mdp, random_policy, gamma, theta, max_iterations)
@@ -197,6 +376,13 @@ if __name__ == "__main__":
             occ_val = occupancy.get_value(state)
             print(f"  State {state}: {occ_val:.6f}")
 
+        # The closed-form solve must agree with the iterative sum up to its truncation error
+        closed_occupancy = compute_occupancy_measure(mdp, random_policy, gamma, theta, max_iterations,
+                                                     closed_form=True)
+        occ_diff = max(abs(closed_occupancy.get_value(s) - occupancy.get_value(s)) for s in mdp.states)
+        print(f"  Closed form: max |d_closed - d_iterative| = {occ_diff:.2e}")
+        assert occ_diff <= theta / (1 - gamma), "Closed-form occupancy measure disagrees with the iterative one"
+
         # Save CSV files for Occupancy Measure
         occupancy.export_to_csv(os.path.join(output_dir, f"{prefix}_{i}_occupancy_measure.csv"))
 